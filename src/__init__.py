@@ -5,8 +5,19 @@ from src.colorlog import logger
 
 # Constants
 RATE_LIMIT_INTERVAL = 1.0
+REQUEST_TIMEOUT = 10.0
+CALL_DEADLINE = 30.0
+RUN_DEADLINE = 780.0
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_COOLDOWN = 60.0
+RECONCILE_SAMPLE_SIZE = 10
+COMPRESS_REQUEST_BODIES = False
+COMPRESS_MIN_SIZE = 1024
 PREFIX = "AdBlock-DNS-Filters"
 CACHE_FILE = "cloudflare_cache.json"
+JOURNAL_FILE = "cloudflare_journal.jsonl"
+JOURNAL_MAX_AGE = 24 * 60 * 60
+JOURNAL_MAX_RESUMES = 3
 
 # Read .env variables 
 def dot_env(file_path=".env"):
@@ -38,6 +49,7 @@ ids_pattern = re.compile(r"\$([a-f0-9-]+)")
 ip_pattern = re.compile(r"^\d{1,3}(\.\d{1,3}){3,4}$")
 replace_pattern = re.compile(r"(^([0-9.]+|[0-9a-fA-F:.]+)\s+|^(\|\||@@\|\||\*\.|\*))")
 domain_pattern = re.compile(r"^(?!-)[a-zA-Z0-9-]{1,63}(?:\.(?!-)[a-zA-Z0-9-]{1,63})*$")
+endpoint_id_pattern = re.compile(r"/[a-f0-9-]{32,36}(?=/|$)")
 
 # Logging functions
 def error(message):
@@ -1,10 +1,12 @@
 import os
+import time
 import argparse
 from src.domains import DomainConverter
 from src.cloudflare import (
     create_list, update_list, create_rule, 
     update_rule, delete_list, delete_rule
 )
+from src.requests import CircuitOpenError, DeadlineExceeded, RunDeadlineExceeded
 from src import utils, info, error, silent_error, PREFIX
 
 class CloudflareManager:
@@ -12,43 +14,81 @@ class CloudflareManager:
         self.list_name = f"[{prefix}]"
         self.rule_name = f"[{prefix}] Block Ads"
         self.cache = utils.load_cache()
+        self.plan, self.completed = utils.replay_journal(self.cache, utils.load_journal())
 
     def update_resources(self):
-        domains_to_block = DomainConverter().process_urls()
-        if len(domains_to_block) > 300000:
-            error("The domains list exceeds Cloudflare Gateway's free limit of 300,000 domains.")
-        
-        current_lists = utils.get_current_lists(self.cache, self.list_name)
+        if self.plan:
+            chunked_domains = self.plan["chunks"]
+            info(f"Resuming interrupted sync, {len(self.completed)} operations already applied")
+            utils.append_journal({"op": "resume"})
+        else:
+            domains_to_block = DomainConverter().process_urls()
+            if len(domains_to_block) > 300000:
+                error("The domains list exceeds Cloudflare Gateway's free limit of 300,000 domains.")
+            chunked_domains = list(utils.split_domain_list(domains_to_block, 1000))
+            utils.append_journal({
+                "op": "plan", "created_at": time.time(), "chunks": chunked_domains
+            })
+
+        if self.cache["mapping"]:
+            current_lists = utils.reconcile_lists(self.cache, self.list_name)
+        else:
+            current_lists = utils.get_current_lists(self.cache, self.list_name)
         current_rules = utils.get_current_rules(self.cache, self.rule_name)
 
-        chunked_domains = list(utils.split_domain_list(domains_to_block, 1000))
         list_ids = []
+        skipped_lists = []
 
         for index, chunk in enumerate(chunked_domains, start=1):
             list_name = f"{self.list_name} - {index:03d}"
-            
-            cgp_list = next((lst for lst in current_lists if lst["name"] == list_name), None)
+            key = f"list:{list_name}"
 
-            if cgp_list:
-                current_values = utils.get_list_items_cached(self.cache, cgp_list["id"])
-                remove_items = set(current_values) - set(chunk)
-                append_items = set(chunk) - set(current_values)
+            # Journaled lists that reconciliation found missing or drifted lost
+            # their cached items, so those are synced again
+            if key in self.completed and self.completed[key]["list"]["id"] in self.cache["mapping"]:
+                list_ids.append(self.completed[key]["list"]["id"])
+                continue
 
-                if not remove_items and not append_items:
-                    silent_error(f"Skipping list update: {cgp_list['name']}")
-                else:
-                    update_list(cgp_list["id"], remove_items, append_items)
-                    info(f"Updated list: {cgp_list['name']}")
-                list_ids.append(cgp_list["id"])
-            
-                self.cache["mapping"][cgp_list["id"]] = chunk
-            else:
-                lst = create_list(list_name, chunk)
-                info(f"Created list: {lst['name']}")
-                list_ids.append(lst["id"])
+            utils.append_journal({"op": "begin", "key": key})
+            cgp_list = next((lst for lst in current_lists if lst["name"] == list_name), None)
 
-                self.cache["lists"].append(lst)
-                self.cache["mapping"][lst["id"]] = chunk
+            try:
+                if cgp_list:
+                    current_values = utils.get_list_items_cached(self.cache, cgp_list["id"])
+                    remove_items = set(current_values) - set(chunk)
+                    append_items = set(chunk) - set(current_values)
+
+                    if not remove_items and not append_items:
+                        silent_error(f"Skipping list update: {cgp_list['name']}")
+                    else:
+                        result = update_list(cgp_list["id"], remove_items, append_items) or {}
+                        info(f"Updated list: {cgp_list['name']}")
+                        # Record our own edit so the next run doesn't see it as drift
+                        cgp_list = {**cgp_list, "updated_at": result.get("updated_at")}
+                    list_ids.append(cgp_list["id"])
+                else:
+                    cgp_list = create_list(list_name, chunk)
+                    info(f"Created list: {cgp_list['name']}")
+                    list_ids.append(cgp_list["id"])
+            except RunDeadlineExceeded:
+                raise
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                # Degrade: leave this list as it is and carry on with the rest
+                silent_error(f"Skipping list for this run: {list_name}: {e}")
+                skipped_lists.append(list_name)
+                if cgp_list:
+                    list_ids.append(cgp_list["id"])
+                    # A partial update may have landed, refetch its items next run
+                    self.cache["mapping"].pop(cgp_list["id"], None)
+                continue
+
+            fingerprint = utils.list_fingerprint(cgp_list, len(chunk))
+            utils.upsert_list(self.cache, fingerprint)
+            self.cache["mapping"][cgp_list["id"]] = chunk
+
+            utils.append_journal({
+                "op": "done", "key": key, "index": index - 1, "list": fingerprint
+            })
 
         utils.save_cache(self.cache)
 
@@ -56,6 +96,8 @@ class CloudflareManager:
         cgp_rule = next((rule for rule in current_rules if rule["name"] == self.rule_name), None)
         cgp_list_ids = utils.extract_list_ids(cgp_rule)
 
+        utils.append_journal({"op": "begin", "key": "rule"})
+        rule = None
         if cgp_rule:
             if set(list_ids) == cgp_list_ids:
                 silent_error(f"Skipping rule update as list IDs are unchanged: {cgp_rule['name']}")
@@ -67,17 +109,25 @@ class CloudflareManager:
             rule = create_rule(self.rule_name, list_ids)
             info(f"Created rule {rule['name']}")
             self.cache["rules"].append(rule)
+        utils.append_journal({"op": "done", "key": "rule", "rule": rule})
 
         # Delete excess lists
         excess_lists = [lst for lst in current_lists if lst["id"] not in list_ids]
         for lst in excess_lists:
+            key = f"delete:{lst['id']}"
+            utils.append_journal({"op": "begin", "key": key})
             delete_list(lst["id"])
             info(f"Deleted excess list: {lst['name']}")
             self.cache["lists"] = [item for item in self.cache["lists"] if item["id"] != lst["id"]]
             if lst["id"] in self.cache["mapping"]:
                 del self.cache["mapping"][lst["id"]]
+            utils.append_journal({"op": "done", "key": key})
 
         utils.save_cache(self.cache)
+        if skipped_lists:
+            # Keep the journal so the next run retries only the skipped lists
+            error(f"Failed to sync {len(skipped_lists)} lists: {', '.join(skipped_lists)}")
+        utils.delete_journal()
 
     def delete_resources(self):
         current_lists = utils.get_current_lists(self.cache, self.list_name)
@@ -98,6 +148,7 @@ class CloudflareManager:
                 del self.cache["mapping"][lst["id"]]
             self.cache["rules"] = []
             utils.save_cache(self.cache)
+        utils.delete_journal()
 
 def main():
     parser = argparse.ArgumentParser(description="Cloudflare Manager Script")
@@ -105,14 +156,18 @@ def main():
     args = parser.parse_args()    
     cloudflare_manager = CloudflareManager(PREFIX)
     
-    if args.action == "run":
-        cloudflare_manager.update_resources()
-        if utils.is_running_in_github_actions():
-            utils.delete_cache()
-    elif args.action == "leave":
-        cloudflare_manager.delete_resources()
-    else:
-        error("Invalid action. Please choose either 'run' or 'leave'.")
+    try:
+        if args.action == "run":
+            cloudflare_manager.update_resources()
+            if utils.is_running_in_github_actions():
+                utils.delete_cache()
+        elif args.action == "leave":
+            cloudflare_manager.delete_resources()
+        else:
+            error("Invalid action. Please choose either 'run' or 'leave'.")
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        utils.save_cache(cloudflare_manager.cache)
+        error(f"Aborting run: {e}")
 
 if __name__ == "__main__":
     main()
@@ -14,7 +14,7 @@ def create_list(name, domains):
         "type": "DOMAIN",
         "items": [{"value": domain} for domain in domains]
     }
-    status, response = cloudflare_gateway_request("POST", endpoint, body=json.dumps(data))
+    status, response = cloudflare_gateway_request("POST", endpoint, body=json.dumps(data, separators=(",", ":")))
     return response["result"]
 
 @retry(**retry_config)
@@ -25,7 +25,7 @@ def update_list(list_id, remove_items, append_items):
         "remove": [domain for domain in remove_items],
         "append": [{"value": domain} for domain in append_items]
     }    
-    status, response = cloudflare_gateway_request("PATCH", endpoint, body=json.dumps(data))
+    status, response = cloudflare_gateway_request("PATCH", endpoint, body=json.dumps(data, separators=(",", ":")))
     return response["result"]
 
 @retry(**retry_config)
@@ -9,13 +9,112 @@ import urllib.parse
 import zlib
 from io import BytesIO
 from functools import wraps
+from email.utils import parsedate_to_datetime
 from typing import Optional, Tuple
-from src import info, silent_error, error, RATE_LIMIT_INTERVAL, CF_IDENTIFIER, CF_API_TOKEN
+from src import (
+    info, silent_error, error, endpoint_id_pattern, RATE_LIMIT_INTERVAL, CF_IDENTIFIER, CF_API_TOKEN,
+    REQUEST_TIMEOUT, CALL_DEADLINE, RUN_DEADLINE, CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN,
+    COMPRESS_REQUEST_BODIES, COMPRESS_MIN_SIZE
+)
 
 class HTTPException(Exception):
+    def __init__(self, message, status=None, retry_after=None, endpoint=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.endpoint = endpoint
+
+class CircuitOpenError(Exception):
+    pass
+
+class DeadlineExceeded(Exception):
+    pass
+
+class RunDeadlineExceeded(DeadlineExceeded):
     pass
 
-def cloudflare_gateway_request(method: str, endpoint: str, body: Optional[str] = None, timeout: int = 10) -> Tuple[int, dict]:
+class RunBudget:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.start_time = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def remaining(self):
+        return self.deadline - self.elapsed()
+
+class RequestCompression:
+    def __init__(self, enabled, min_size):
+        self.enabled = enabled
+        self.min_size = min_size
+
+    def applies_to(self, body):
+        return self.enabled and body is not None and len(body) >= self.min_size
+
+    def is_rejection(self, status, data):
+        # The API refusing a gzip body, as opposed to a genuine client error
+        return status == 415 or (status == 400 and b"content-encoding" in data.lower())
+
+    def disable(self):
+        self.enabled = False
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.opened_at = {}
+
+    def before_request(self, key):
+        opened_at = self.opened_at.get(key)
+        if opened_at is None:
+            return
+        if time.monotonic() - opened_at < self.cooldown:
+            raise CircuitOpenError(
+                f"Circuit open for {key} after {self.failures[key]} consecutive failures"
+            )
+        # Half-open: let one trial request through, a further failure re-opens
+        del self.opened_at[key]
+
+    def record_success(self, key):
+        self.failures.pop(key, None)
+        self.opened_at.pop(key, None)
+
+    def record_failure(self, key):
+        self.failures[key] = self.failures.get(key, 0) + 1
+        if self.failures[key] >= self.threshold:
+            self.opened_at[key] = time.monotonic()
+
+request_compression = RequestCompression(COMPRESS_REQUEST_BODIES, COMPRESS_MIN_SIZE)
+run_budget = RunBudget(RUN_DEADLINE)
+circuit_breaker = CircuitBreaker(CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN)
+
+def endpoint_key(method, endpoint):
+    path = endpoint.split("?", 1)[0]
+    return f"{method} {endpoint_id_pattern.sub('/{id}', path)}"
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def cloudflare_gateway_request(method: str, endpoint: str, body: Optional[str] = None, timeout: float = REQUEST_TIMEOUT) -> Tuple[int, dict]:
+    key = endpoint_key(method, endpoint)
+    circuit_breaker.before_request(key)
+
+    remaining = run_budget.remaining()
+    if remaining <= 0:
+        raise RunDeadlineExceeded(f"Run deadline of {run_budget.deadline}s exceeded before {key}")
+    timeout = min(timeout, remaining)
+
     context = ssl.create_default_context()
     conn = http.client.HTTPSConnection("api.cloudflare.com", context=context, timeout=timeout)
 
@@ -25,6 +124,11 @@ def cloudflare_gateway_request(method: str, endpoint: str, body: Optional[str] =
         "Accept-Encoding": "gzip, deflate"
     }
 
+    compressed = request_compression.applies_to(body)
+    if compressed:
+        body = gzip.compress(body.encode('utf-8'))
+        headers["Content-Encoding"] = "gzip"
+
     url = f"/client/v4/accounts/{CF_IDENTIFIER}/gateway{endpoint}"
     full_url = f"https://api.cloudflare.com{url}"
 
@@ -42,41 +146,81 @@ def cloudflare_gateway_request(method: str, endpoint: str, body: Optional[str] =
         elif content_encoding == 'deflate':
             data = zlib.decompress(data)
 
+        if compressed and request_compression.is_rejection(status, data):
+            # Fall back to plain bodies for the rest of the run and let retry resend
+            request_compression.disable()
+            silent_error(f"Compressed request body rejected for url: {full_url}, disabling compression")
+            raise HTTPException("Compressed request body rejected", status, endpoint=key)
+
         if status >= 400:
             error_message = f"Request failed: {status} {response.reason}, Body: {data.decode('utf-8', errors='ignore')} for url: {full_url}"
             if status in [400, 403, 404]:
                 error(error_message)
             else:
                 silent_error(error_message)
-            raise HTTPException(error_message)
+            raise HTTPException(
+                error_message, status, parse_retry_after(response.getheader('Retry-After')), key
+            )
 
-        return status, json.loads(data.decode('utf-8'))
+        result = json.loads(data.decode('utf-8'))
+        circuit_breaker.record_success(key)
+        return status, result
 
     except (http.client.HTTPException, ssl.SSLError, socket.timeout, OSError) as e:
         error_message = f"Network error occurred: {e}"
         info(error_message)
-        raise HTTPException(error_message)
+        raise HTTPException(error_message, endpoint=key)
     except json.JSONDecodeError:
         error_message = "Failed to decode JSON response"
         info(error_message)
-        raise HTTPException(error_message)
+        raise HTTPException(error_message, endpoint=key)
     finally:
         conn.close()
 
-def stop_never(attempt_number):
-    return False
+# Stop functions return the exception to give up with, or False to keep going.
+# They stop before the next sleep and attempt could run past the budget.
+def stop_after_delay(max_delay, attempt_timeout=0):
+    return lambda retry_state: (
+        retry_state['elapsed'] + retry_state['upcoming_sleep'] + attempt_timeout >= max_delay
+    ) and DeadlineExceeded
+
+def stop_after_run_deadline(budget, attempt_timeout=0):
+    return lambda retry_state: (
+        retry_state['upcoming_sleep'] + attempt_timeout >= budget.remaining()
+    ) and RunDeadlineExceeded
+
+def stop_any(*stops):
+    return lambda retry_state: next(
+        (give_up for give_up in (stop(retry_state) for stop in stops) if give_up), False
+    )
 
 def wait_random_exponential(attempt_number, multiplier=1, max_wait=10):
     return min(multiplier * (2 ** random.uniform(0, attempt_number - 1)), max_wait)
 
+def wait_server_hint(fallback, max_wait=60):
+    def wait(retry_state):
+        retry_after = getattr(retry_state['outcome'], 'retry_after', None)
+        if retry_after is not None:
+            # Honour the server hint, with a little jitter so runs don't stampede
+            return min(retry_after + random.uniform(0, 1), max_wait)
+        return fallback(retry_state)
+    return wait
+
 def retry_if_exception_type(exceptions):
     return lambda e: isinstance(e, exceptions)
 
-def retry(stop=None, wait=None, retry=None, after=None, before_sleep=None):
+def record_call_failure(retry_state):
+    # One failure per call that ran out of retries; throttling isn't an outage
+    outcome = retry_state['outcome']
+    if outcome.endpoint and outcome.status != 429:
+        circuit_breaker.record_failure(outcome.endpoint)
+
+def retry(stop=None, wait=None, retry=None, after=None, before_sleep=None, on_give_up=None):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             attempt_number = 0
+            start_time = time.monotonic()
             while True:
                 try:
                     attempt_number += 1
@@ -84,25 +228,42 @@ def retry(stop=None, wait=None, retry=None, after=None, before_sleep=None):
                 except Exception as e:
                     if retry and not retry(e):
                         raise
+                    retry_state = {
+                        'attempt_number': attempt_number,
+                        'outcome': e,
+                        'elapsed': time.monotonic() - start_time,
+                    }
                     if after:
-                        after({'attempt_number': attempt_number, 'outcome': e})
-                    if stop and stop(attempt_number):
-                        raise
+                        after(retry_state)
+                    retry_state['upcoming_sleep'] = wait(retry_state) if wait else 1
+                    give_up = stop(retry_state) if stop else False
+                    if give_up:
+                        if on_give_up:
+                            on_give_up(retry_state)
+                        raise give_up(
+                            f"{func.__name__} gave up after {attempt_number} attempts "
+                            f"({retry_state['elapsed']:.1f}s): {e}"
+                        ) from e
                     if before_sleep:
-                        before_sleep({'attempt_number': attempt_number})
-                    wait_time = wait(attempt_number) if wait else 1
-                    time.sleep(wait_time)
+                        before_sleep(retry_state)
+                    time.sleep(retry_state['upcoming_sleep'])
         return wrapper
     return decorator
 
 retry_config = {
-    'stop': stop_never,
-    'wait': lambda attempt_number: wait_random_exponential(
-        attempt_number, multiplier=1, max_wait=10
+    'stop': stop_any(
+        stop_after_delay(CALL_DEADLINE, REQUEST_TIMEOUT),
+        stop_after_run_deadline(run_budget, REQUEST_TIMEOUT)
+    ),
+    'wait': wait_server_hint(
+        lambda retry_state: wait_random_exponential(
+            retry_state['attempt_number'], multiplier=1, max_wait=10
+        )
     ),
     'retry': retry_if_exception_type((HTTPException,)),
+    'on_give_up': record_call_failure,
     'before_sleep': lambda retry_state: info(
-        f"Sleeping before next retry ({retry_state['attempt_number']})"
+        f"Sleeping {retry_state['upcoming_sleep']:.1f}s before next retry ({retry_state['attempt_number']})"
     )
 }
 
@@ -1,7 +1,12 @@
 import os
+import re
 import json
+import time
 import http.client
-from src import ids_pattern, CACHE_FILE
+from src import (
+    ids_pattern, info, silent_error, CACHE_FILE, JOURNAL_FILE,
+    JOURNAL_MAX_AGE, JOURNAL_MAX_RESUMES, RECONCILE_SAMPLE_SIZE
+)
 from src.cloudflare import get_lists, get_rules, get_list_items
 
 
@@ -39,7 +44,9 @@ def load_cache():
             
             delete_completed_workflows(completed_run_ids)
 
-            if workflow_status == 'success':
+            # An interrupted run leaves its journal behind, which replay_journal
+            # uses to bring the cache it saved back in line with Cloudflare
+            if workflow_status == 'success' or os.path.exists(JOURNAL_FILE):
                 if os.path.exists(CACHE_FILE):
                     with open(CACHE_FILE, 'r') as file:
                         return json.load(file)
@@ -58,13 +65,88 @@ def save_cache(cache):
         json.dump(cache, file)
 
 
+def load_journal():
+    entries = []
+    if os.path.exists(JOURNAL_FILE):
+        with open(JOURNAL_FILE, 'r') as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A run killed mid-write leaves a truncated last line,
+                    # rewrite the journal without it so new entries append cleanly
+                    with open(JOURNAL_FILE, 'w') as journal:
+                        journal.writelines(json.dumps(entry) + "\n" for entry in entries)
+                    break
+    return entries
+
+
+def append_journal(entry):
+    with open(JOURNAL_FILE, 'a') as file:
+        file.write(json.dumps(entry) + "\n")
+
+
+def delete_journal():
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+
+
+def replay_journal(cache, entries):
+    plan = None
+    completed = {}
+    pending = set()
+    resumes = 0
+
+    for entry in entries:
+        if entry["op"] == "plan":
+            plan, completed, pending, resumes = entry, {}, set(), 0
+        elif entry["op"] == "resume":
+            resumes += 1
+        elif entry["op"] == "begin":
+            pending.add(entry["key"])
+        elif entry["op"] == "done":
+            pending.discard(entry["key"])
+            completed[entry["key"]] = entry
+            if entry["key"].startswith("list:"):
+                lst = entry["list"]
+                upsert_list(cache, lst)
+                cache["mapping"][lst["id"]] = plan["chunks"][entry["index"]]
+            elif entry["key"].startswith("delete:"):
+                list_id = entry["key"].split(":", 1)[1]
+                cache["lists"] = [item for item in cache["lists"] if item["id"] != list_id]
+                cache["mapping"].pop(list_id, None)
+            elif entry["key"] == "rule" and entry.get("rule"):
+                cache["rules"] = [entry["rule"]]
+
+    # Operations that were started but never finished may or may not have
+    # been applied, so drop what the cache believes about them and refetch
+    for key in pending:
+        if key.startswith("list:"):
+            name = key.split(":", 1)[1]
+            for item in cache["lists"]:
+                if item["name"] == name:
+                    cache["mapping"].pop(item["id"], None)
+        elif key == "rule":
+            cache["rules"] = []
+    if any(key.startswith(("list:", "delete:")) for key in pending):
+        cache["lists"] = []
+
+    # A plan that keeps failing must not pin every later run to stale sources
+    if plan and (time.time() - plan.get("created_at", 0) > JOURNAL_MAX_AGE
+                 or resumes >= JOURNAL_MAX_RESUMES):
+        info(f"Discarding sync journal after {resumes} resumes, planning from scratch")
+        delete_journal()
+        return None, {}
+
+    return plan, completed
+
+
 def get_current_lists(cache, list_name):
     if cache["lists"]:
         return cache["lists"]
-    current_lists = get_lists(list_name)
-    cache["lists"] = current_lists
+    cache["lists"] = [list_fingerprint(lst) for lst in get_lists(list_name)]
     save_cache(cache)
-    return current_lists
+    return cache["lists"]
 
 
 def get_current_rules(cache, rule_name):
@@ -76,6 +158,69 @@ def get_current_rules(cache, rule_name):
     return current_rules
 
 
+def list_fingerprint(lst, count=None):
+    fingerprint = {
+        "id": lst["id"],
+        "name": lst["name"],
+        "count": lst.get("count") if count is None else count
+    }
+    if lst.get("updated_at"):
+        fingerprint["updated_at"] = lst["updated_at"]
+    return fingerprint
+
+
+def upsert_list(cache, fingerprint):
+    for index, item in enumerate(cache["lists"]):
+        if item["id"] == fingerprint["id"]:
+            cache["lists"][index] = fingerprint
+            return
+    cache["lists"].append(fingerprint)
+
+
+def reconcile_lists(cache, list_name, sample_size=RECONCILE_SAMPLE_SIZE):
+    remote_lists = get_lists(list_name)
+    cached_lists = {lst["id"]: lst for lst in cache["lists"]}
+    drifted = []
+
+    # Cheap pass: one GET /lists covers every list's count and updated_at
+    for lst in remote_lists:
+        if lst["id"] not in cache["mapping"]:
+            continue
+        cached = cached_lists.get(lst["id"], {})
+        count_changed = lst.get("count") is not None and \
+            lst["count"] != len(cache["mapping"][lst["id"]])
+        updated_changed = cached.get("updated_at") is not None and \
+            cached["updated_at"] != lst.get("updated_at")
+        if count_changed or updated_changed:
+            drifted.append(lst["name"])
+            del cache["mapping"][lst["id"]]
+
+    remote_ids = {lst["id"] for lst in remote_lists}
+    for list_id in list(cache["mapping"]):
+        if list_id not in remote_ids:
+            del cache["mapping"][list_id]
+    cache["lists"] = [list_fingerprint(lst) for lst in remote_lists]
+
+    # Rotating sample: compare the full contents of a few lists per run
+    verifiable = sorted(
+        (lst for lst in cache["lists"] if lst["id"] in cache["mapping"]), key=safe_sort_key
+    )
+    if verifiable and sample_size > 0:
+        cursor = cache.get("reconcile_cursor", 0) % len(verifiable)
+        sample = (verifiable[cursor:] + verifiable[:cursor])[:sample_size]
+        cache["reconcile_cursor"] = cursor + len(sample)
+        for lst in sample:
+            items = get_list_items(lst["id"])
+            if set(items) != set(cache["mapping"][lst["id"]]):
+                drifted.append(lst["name"])
+                cache["mapping"][lst["id"]] = items
+
+    if drifted:
+        silent_error(f"Detected remote drift in {len(drifted)} lists: {', '.join(drifted)}")
+    save_cache(cache)
+    return cache["lists"]
+
+
 def get_list_items_cached(cache, list_id):
     if list_id in cache["mapping"]:
         return cache["mapping"][list_id]